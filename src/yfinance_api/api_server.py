@@ -2,20 +2,40 @@
 # Main file
 #
 # api_server.py
-from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, Request, Query
+import asyncio
+import logging
+import re
+import sys
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, suppress
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
 import uvicorn
 from typing import Optional
 
+try:
+    from prometheus_client import make_asgi_app
+except ImportError:  # optional dependency: pip install "yfinance-api-server[metrics]"
+    make_asgi_app = None
+
 from core_services import (
     logger,
     ip_counts,
     save_ip_counts,
     server_config,
-    logging_config
+    logging_config,
+    to_json
 )
 from yfinance_service import (
+    SymbolNotFound,
+    UpstreamError,
+    cache_stats,
+    close_cache,
+    close_session,
+    warm_up,
     get_info,
     get_quote,
     get_history,
@@ -25,25 +45,61 @@ from yfinance_service import (
     get_calendar
 )
 
+# --- Response Class ---
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson (core_services.to_json, the same encoder
+    used for the cached payloads): much faster than the stdlib encoder.
+    (Defined here because fastapi.responses.ORJSONResponse is deprecated.)
+    """
+    def render(self, content) -> bytes:
+        return to_json(content)
+
 # --- Lifespan Manager ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup logic
     logger.info("Server starting up...")
+    logger.info(f"Event loop implementation: {type(asyncio.get_running_loop())}")
+    # Blocking yfinance calls run in the loop's default executor (asyncio.to_thread)
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE))
+    warmup_task = None
+    if WARMUP_SYMBOL:
+        # In background: the server accepts requests while the warm-up runs
+        warmup_task = asyncio.create_task(asyncio.to_thread(warm_up, WARMUP_SYMBOL))
+    flush_task = None
+    if WRITE_FREQ > 0:
+        flush_task = asyncio.create_task(flush_ip_counts_periodically())
+    stats_task = None
+    if CACHE_STATS_INTERVAL > 0:
+        stats_task = asyncio.create_task(log_cache_stats_periodically())
     yield  # The application runs while yielding
     
     # Shutdown logic
+    if flush_task:
+        # wait for it: a write in progress must end before the final one below
+        flush_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await flush_task
+    if stats_task:
+        stats_task.cancel()
+    if warmup_task:
+        warmup_task.cancel()  # a still-running warm-up is not worth waiting for
     logger.info("Server shutting down. Saving final IP counts...")
     try:
+        merge_pending_ip_counts()
         save_ip_counts(logging_config.get("ip_counts_file"), ip_counts)
         logger.info("Final IP counts saved successfully.")
     except Exception as e:
         logger.error(f"Failed to save IP counts on shutdown: {e}")
+    close_session()
+    await close_cache()
 
 # --- App Init ---
 app = FastAPI(
     title="yFinance API",
     description="A unified, self-hosted API for yFinance data.",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -56,103 +112,225 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# info/history payloads are large, repetitive JSON: compress them on the wire
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
+THREAD_POOL_SIZE = server_config.get("thread_pool_size", 64)
+WARMUP_SYMBOL = server_config.get("warmup_symbol", "SPY")
 WRITE_FREQ = logging_config.get("ip_write_frequency", 50)
+WRITE_INTERVAL = logging_config.get("ip_write_interval_seconds", 30)
+CACHE_STATS_INTERVAL = logging_config.get("cache_stats_interval_seconds", 60)
 
-@app.middleware("http")
-async def ip_counter_middleware(request: Request, call_next):
-    client_ip = request.client.host
-    ip_counts[client_ip] += 1
-    logger.info(f"Request from {client_ip}: {request.method} {request.url.path}")
-    
-    if WRITE_FREQ > 0 and sum(ip_counts.values()) % WRITE_FREQ == 0:
-        save_ip_counts(logging_config.get("ip_counts_file"), ip_counts)
+# Running total of requests: seeded once from the persisted counts (so the write
+# cadence survives restarts), then incremented in O(1) by the middleware
+total_requests = sum(ip_counts.values())
+
+# Per-IP increments since the last flush, merged into ip_counts in a single update()
+pending_ip_counts = Counter()
+
+# Set by the middleware, cleared by the background flusher once the counts are on disk
+ip_counts_dirty = asyncio.Event()
+ip_counts_flush_now = asyncio.Event()  # every WRITE_FREQ requests, skips the rest of the write window
+
+class IPCounterMiddleware:
+    """
+    Pure ASGI middleware counting requests per client IP.
+    Only reads the scope and forwards scope/receive/send untouched, so it avoids
+    the Request/Response wrapping done by @app.middleware("http").
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        global total_requests
+        client = scope.get("client")
+        client_ip = client[0] if client else "unknown"
+        total_requests += 1
+        pending_ip_counts[client_ip] += 1
+        ip_counts_dirty.set()
+        if WRITE_FREQ > 0 and total_requests % WRITE_FREQ == 0:
+            ip_counts_flush_now.set()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Request from %s: %s %s", client_ip, scope["method"], scope["path"])
+
+        await self.app(scope, receive, send)
+
+app.add_middleware(IPCounterMiddleware)
 
-    return await call_next(request)
+def merge_pending_ip_counts():
+    """
+    Moves the buffered increments into ip_counts. No lock is needed: like the
+    middleware, it only runs on the event loop thread.
+    """
+    global pending_ip_counts
+    delta, pending_ip_counts = pending_ip_counts, Counter()
+    ip_counts.update(delta)
+
+async def flush_ip_counts_periodically():
+    """
+    Writes the IP counts every WRITE_FREQ requests or WRITE_INTERVAL seconds,
+    whichever comes first, and only when they changed. The file write runs in a
+    worker thread, off the event loop.
+    """
+    while True:
+        await ip_counts_dirty.wait()
+        try:
+            # batch all the requests of the window in one write
+            await asyncio.wait_for(ip_counts_flush_now.wait(), timeout=WRITE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        ip_counts_dirty.clear()
+        ip_counts_flush_now.clear()
+        merge_pending_ip_counts()
+        save = asyncio.ensure_future(asyncio.to_thread(save_ip_counts, logging_config.get("ip_counts_file"), dict(ip_counts)))
+        try:
+            await asyncio.shield(save)
+        except asyncio.CancelledError:
+            # cancelling does not stop the worker thread: let its write finish
+            await save
+            raise
+
+async def log_cache_stats_periodically():
+    """
+    Logs one aggregate cache line every CACHE_STATS_INTERVAL seconds (instead of
+    a line per miss), skipped when there was no traffic since the previous one.
+    """
+    last = None
+    while True:
+        await asyncio.sleep(CACHE_STATS_INTERVAL)
+        total = cache_stats()["total"]
+        if total != last:
+            last = total
+            ratio = f"{total['hit_ratio']:.1%}" if total["hit_ratio"] is not None else "n/a"
+            logger.info(f"Cache stats: {total['hits']} hits ({total['stale_hits']} stale), {total['misses']} misses, "
+                        f"{total['fetches']} fetches, {total['errors']} errors, hit ratio {ratio}")
 
 # --- Helper: Symbol Parser ---
+# Commas and blanks separate the symbols. A symbol is letters, digits and the
+# . - ^ = used by Yahoo (ENI.MI, BRK-B, ^GSPC, EURUSD=X), at most MAX_SYMBOL_LEN
+# long: anything else is rejected without going upstream.
+MAX_SYMBOL_LEN = 20
+_SEP_RE = re.compile(r"[,\s]+")
+_SYM_RE = re.compile(rf"[A-Z0-9.\-^=]{{1,{MAX_SYMBOL_LEN}}}")
+
 def parse_symbols(symbol: Optional[str], symbols: Optional[str]):
     """
     Consolidates 'symbol' and 'symbols' query params into a unique list.
+    One split tokenizes both (commas and blanks are separators), each token is
+    validated, then duplicates are dropped as they are met, preserving order.
+    Raises 422 on an invalid symbol, 400 when there is none.
     """
+    # 'symbols' (plural) first, then 'symbol' (singular, legacy or convenience)
+    tokens = _SEP_RE.split(f"{symbols or ''},{symbol or ''}".upper())
+
+    seen = set()
     final_list = []
-    
-    # Handle 'symbols' (plural, comma separated)
-    if symbols:
-        final_list.extend([s.strip().upper() for s in symbols.split(",") if s.strip()])
-    
-    # Handle 'symbol' (singular, legacy or convenience)
-    if symbol:
-        final_list.extend([s.strip().upper() for s in symbol.split(",") if s.strip()])
+    for s in tokens:
+        if not s:
+            continue
+        if not _SYM_RE.fullmatch(s):
+            raise HTTPException(status_code=422, detail=f"Invalid ticker symbol '{s[:MAX_SYMBOL_LEN]}'")
+        if s not in seen:
+            seen.add(s)
+            final_list.append(s)
         
     if not final_list:
         raise HTTPException(status_code=400, detail="No ticker symbols provided. Use ?symbols=AAPL,MSFT")
         
-    # Remove duplicates while preserving order
-    return list(dict.fromkeys(final_list))
+    return final_list
 
 # --- Unified Endpoints ---
 
-@app.get("/")
-def root():
-    return {"status": "online", "endpoints": ["/tickers/info", "/tickers/quote", "/tickers/history"]}
+@app.get("/", response_class=ORJSONResponse, response_model=None)
+async def root():
+    return ORJSONResponse({"status": "online", "endpoints": ["/tickers/info", "/tickers/quote", "/tickers/history"]})
 
-@app.get("/tickers/info")
-def route_info(
+# The service runs the blocking yfinance calls in worker threads (cache misses
+# only), so the event loop keeps serving other requests while waiting for Yahoo.
+# It returns ready JSON responses: FastAPI sends them as they are,
+# without jsonable_encoder or response model validation.
+
+@app.get("/tickers/info", response_class=ORJSONResponse, response_model=None)
+async def route_info(
     symbol: str = Query(None, description="Single symbol (alias)"),
     symbols: str = Query(None, description="Comma separated symbols")
 ):
     """Get full info for one or more tickers."""
     target_list = parse_symbols(symbol, symbols)
     try:
-        return get_info(target_list)
+        return await get_info(target_list)
+    except (SymbolNotFound, UpstreamError) as e:
+        # unknown symbol (fresh or replayed from the cache): the client's fault, not ours
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/tickers/quote")
-def route_quote(
+@app.get("/tickers/quote", response_class=ORJSONResponse, response_model=None)
+async def route_quote(
     symbol: str = Query(None),
     symbols: str = Query(None)
 ):
     """Get lightweight quote for one or more tickers."""
     target_list = parse_symbols(symbol, symbols)
     try:
-        return get_quote(target_list)
+        return await get_quote(target_list)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/tickers/history")
-def route_history(
+@app.get("/tickers/history", response_class=ORJSONResponse, response_model=None)
+async def route_history(
     symbol: str = Query(None),
     symbols: str = Query(None),
     period: str = "1mo",
-    interval: str = "1d"
+    interval: str = "1d",
+    orient: str = Query("records", pattern="^(records|columns)$", description="'records' (rows) or 'columns'")
 ):
     """Get historical data for one or more tickers."""
     target_list = parse_symbols(symbol, symbols)
     try:
-        return get_history(target_list, period, interval)
+        return await get_history(target_list, period, interval, orient)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/tickers/dividends")
-def route_dividends(symbol: str = Query(None), symbols: str = Query(None)):
-    return get_dividends(parse_symbols(symbol, symbols))
+@app.get("/tickers/dividends", response_class=ORJSONResponse, response_model=None)
+async def route_dividends(symbol: str = Query(None), symbols: str = Query(None)):
+    return await get_dividends(parse_symbols(symbol, symbols))
+
+@app.get("/tickers/splits", response_class=ORJSONResponse, response_model=None)
+async def route_splits(symbol: str = Query(None), symbols: str = Query(None)):
+    return await get_splits(parse_symbols(symbol, symbols))
+
+@app.get("/tickers/recommendations", response_class=ORJSONResponse, response_model=None)
+async def route_recs(symbol: str = Query(None), symbols: str = Query(None)):
+    return await get_recommendations(parse_symbols(symbol, symbols))
+
+@app.get("/tickers/calendar", response_class=ORJSONResponse, response_model=None)
+async def route_calendar(symbol: str = Query(None), symbols: str = Query(None)):
+    return await get_calendar(parse_symbols(symbol, symbols))
 
-@app.get("/tickers/splits")
-def route_splits(symbol: str = Query(None), symbols: str = Query(None)):
-    return get_splits(parse_symbols(symbol, symbols))
+# --- Monitoring ---
 
-@app.get("/tickers/recommendations")
-def route_recs(symbol: str = Query(None), symbols: str = Query(None)):
-    return get_recommendations(parse_symbols(symbol, symbols))
+@app.get("/cache/stats", response_class=ORJSONResponse, response_model=None)
+async def route_cache_stats():
+    """Cache hits, misses and upstream fetches by resource, to tune TTLs and sizes."""
+    return ORJSONResponse(cache_stats())
 
-@app.get("/tickers/calendar")
-def route_calendar(symbol: str = Query(None), symbols: str = Query(None)):
-    return get_calendar(parse_symbols(symbol, symbols))
+if make_asgi_app is not None:
+    # Prometheus scrape endpoint (yf_cache_*_total counters), when prometheus_client is installed
+    app.mount("/metrics", make_asgi_app())
 
 # --- Main Execution ---
 if __name__ == "__main__":
     h = server_config.get("host", "0.0.0.0")
     p = server_config.get("port", 5000)
     logger.info(f"Starting server on {h}:{p}")
-    uvicorn.run("api_server:app", host=h, port=p, reload=False)
+    # Force the fast implementations instead of silently falling back to asyncio/h11
+    # (uvloop does not support Windows, where it is not installed)
+    loop = "uvloop" if sys.platform != "win32" else "auto"
+    uvicorn.run("api_server:app", host=h, port=p, reload=False, loop=loop, http="httptools")
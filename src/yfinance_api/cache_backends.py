@@ -0,0 +1,143 @@
+##
+# Storage backends for the yfinance data cache
+#
+# cache_backends.py
+from typing import Optional, Protocol
+from cachetools import TLRUCache
+from core_services import logger
+
+try:
+    import redis.asyncio as redis_asyncio
+    from redis.exceptions import RedisError
+except ImportError:  # optional dependency: pip install "yfinance-api-server[redis]"
+    redis_asyncio = None
+    RedisError = OSError
+
+class CacheBackend(Protocol):
+    """
+    Stores the JSON-encoded payloads of yfinance_service.
+    Keys are tuples (kind, *args) of strings, values are bytes.
+    get() returns (value, remaining seconds to live), or None on a miss.
+    """
+    async def get(self, key) -> Optional[tuple[bytes, float]]: ...
+    async def setex(self, key, ttl, value: bytes) -> None: ...
+    async def close(self) -> None: ...
+    def stats(self) -> dict: ...
+
+class NullBackend:
+    """Stores nothing: used when caching is disabled."""
+    async def get(self, key):
+        return None
+
+    async def setex(self, key, ttl, value):
+        pass
+
+    async def close(self):
+        pass
+
+    def stats(self):
+        return {"type": "none"}
+
+class _CountingTLRUCache(TLRUCache):
+    """TLRUCache counting the entries evicted to make room (expired ones are not counted)."""
+    evictions = 0
+
+    def popitem(self):
+        self.evictions += 1
+        return super().popitem()
+
+class MemoryBackend:
+    """
+    In-process LRU cache where every entry has its own TTL.
+    With max_ttl, entries are dropped after at most max_ttl seconds but still
+    report the remaining lifetime of their full TTL (used as L1 of TieredBackend).
+    """
+    def __init__(self, maxsize, max_ttl=None):
+        self._max_ttl = max_ttl
+        # entries are (lifetime, value, expires_at): the TTL travels with the value
+        self._cache = _CountingTLRUCache(maxsize=maxsize, ttu=lambda key, entry, now: now + entry[0])
+
+    async def get(self, key):
+        entry = self._cache.get(key)
+        return (entry[1], entry[2] - self._cache.timer()) if entry else None
+
+    async def setex(self, key, ttl, value):
+        lifetime = ttl if self._max_ttl is None else min(ttl, self._max_ttl)
+        self._cache[key] = (lifetime, value, self._cache.timer() + ttl)
+
+    async def close(self):
+        self._cache.clear()
+
+    def stats(self):
+        return {"type": "memory", "size": len(self._cache), "maxsize": self._cache.maxsize,
+                "evictions": self._cache.evictions}
+
+class RedisBackend:
+    """
+    Redis cache shared by all the workers/processes of the server, so the hit
+    ratio follows the total traffic instead of the traffic of each worker.
+    Redis errors are logged and handled as cache misses.
+    """
+    def __init__(self, redis_url, namespace="yf"):
+        if redis_asyncio is None:
+            raise RuntimeError("The redis cache backend requires the 'redis' package (pip install redis)")
+        self._redis = redis_asyncio.Redis.from_url(redis_url)
+        self._namespace = namespace
+
+    def _key(self, key):
+        # ("history", "AAPL", "1mo", "1d") -> "yf:history:AAPL:1mo:1d"
+        return ":".join((self._namespace, *map(str, key)))
+
+    async def get(self, key):
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                value, remaining = await pipe.get(self._key(key)).ttl(self._key(key)).execute()
+        except RedisError as e:
+            logger.warning(f"Redis cache read failed: {e}")
+            return None
+        # TTL is -2 when the key expired between the GET and the TTL: a miss.
+        # -1 (no expiry) is only possible for keys written by something else.
+        if value is None or remaining == -2:
+            return None
+        return value, (float("inf") if remaining == -1 else remaining)
+
+    async def setex(self, key, ttl, value):
+        try:
+            await self._redis.set(self._key(key), value, ex=max(1, int(ttl)))
+        except RedisError as e:
+            logger.warning(f"Redis cache write failed: {e}")
+
+    async def close(self):
+        await self._redis.aclose()
+
+    def stats(self):
+        # size and evictions are Redis' own: see INFO stats / keyspace
+        return {"type": "redis"}
+
+class TieredBackend:
+    """
+    Small, short-lived in-process L1 in front of a shared L2 (Redis): the hottest
+    keys are served without a network round trip, the long tail is still shared.
+    """
+    def __init__(self, l2, l1_maxsize=256, l1_ttl=10):
+        self._l1 = MemoryBackend(l1_maxsize, max_ttl=l1_ttl)
+        self._l2 = l2
+
+    async def get(self, key):
+        entry = await self._l1.get(key)
+        if entry is None:
+            entry = await self._l2.get(key)
+            if entry is not None:
+                await self._l1.setex(key, entry[1], entry[0])
+        return entry
+
+    async def setex(self, key, ttl, value):
+        await self._l1.setex(key, ttl, value)
+        await self._l2.setex(key, ttl, value)
+
+    async def close(self):
+        await self._l1.close()
+        await self._l2.close()
+
+    def stats(self):
+        return {"type": "tiered", "l1": self._l1.stats(), "l2": self._l2.stats()}
@@ -1,8 +1,12 @@
 # core_services.py
 import json5 as json
+import orjson
 import logging
 import sys
 import os
+import atexit
+import queue
+from logging.handlers import QueueHandler, QueueListener
 from collections import Counter
 
 # --- Config Path Logic ---
@@ -26,6 +30,19 @@ def ensure_directory_exists(file_path):
         except OSError as e:
             print(f"Warning: Could not create directory '{directory}': {e}", file=sys.stderr)
 
+def json_default(obj):
+    """orjson fallback for the values it does not handle natively (e.g. pandas Timestamp)."""
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+def to_json(data):
+    """
+    Encodes data as JSON bytes: the single encoder for cached payloads and
+    responses. NaN becomes null, numpy values and pandas Timestamps are supported.
+    """
+    return orjson.dumps(data, default=json_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
 def load_config(config_path):
     """Loads configuration, handling json5 and missing files."""
     if not os.path.exists(config_path):
@@ -41,17 +58,28 @@ def load_config(config_path):
         sys.exit(1)
 
 def setup_logging(log_file):
-    """Configures the logger, ensuring the target directory exists."""
+    """
+    Configures the logger, ensuring the target directory exists.
+    Records go through a queue and are written by a background listener thread,
+    so logging never blocks a request on file/console I/O.
+    """
     ensure_directory_exists(log_file)
 
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s - %(levelname)s - %(message)s",
-        handlers=[
-            logging.FileHandler(log_file) if log_file else logging.StreamHandler(sys.stdout),
-            logging.StreamHandler(sys.stdout)
-        ]
-    )
+    formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    handlers = [
+        logging.FileHandler(log_file) if log_file else logging.StreamHandler(sys.stdout),
+        logging.StreamHandler(sys.stdout)
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # flush the pending records on exit
+
+    # The listener's handlers apply the real format; the queue only carries the message
+    logging.basicConfig(level=logging.INFO, format="%(message)s", handlers=[QueueHandler(log_queue)])
     return logging.getLogger(__name__)
 
 def load_ip_counts(path):
@@ -59,11 +87,21 @@ def load_ip_counts(path):
     ensure_directory_exists(path)
 
     try:
-        with open(path, "r") as f:
-            return Counter(json.load(f))
+        with open(path, "rb") as f:
+            raw = f.read()
+    except FileNotFoundError:
+        return Counter()
+
+    try:
+        return Counter(orjson.loads(raw))
+    except (orjson.JSONDecodeError, TypeError):
+        pass
+    try:
+        # Files written by older versions are json5 (unquoted keys, trailing commas)
+        return Counter(json.loads(raw.decode("utf-8")))
     # FIX: json5 raises ValueError on decode errors, not JSONDecodeError
-    except (FileNotFoundError, ValueError, TypeError):
-        # If file doesn't exist or is corrupted, start fresh
+    except (ValueError, TypeError):
+        # If file is corrupted, start fresh
         return Counter()
 
 def save_ip_counts(path, counts):
@@ -74,8 +112,8 @@ def save_ip_counts(path, counts):
     ensure_directory_exists(path)
     
     try:
-        with open(path, "w") as f:
-            json.dump(counts, f, indent=4)
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(dict(counts), option=orjson.OPT_INDENT_2))
     except IOError as e:
         logger.error(f"Could not save IP counts to {path}: {e}")
 
@@ -88,6 +126,7 @@ config = load_config(CONFIG_PATH)
 server_config = config.get("server", {})
 logging_config = config.get("logging", {})
 cache_config = config.get("caching", {})
+yahoo_config = config.get("yahoo", {})
 
 # 3. Setup Logging
 log_file_path = logging_config.get("main_log_file", "logs/activity.log")
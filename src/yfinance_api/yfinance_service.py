@@ -2,48 +2,364 @@
 # yfinance endpoints with cache management
 #
 # yfinance_service.py
+import numpy as np
+import pandas as pd
 import yfinance as yf
-from fastapi import HTTPException
-from cachetools import TTLCache, cached
-from core_services import logger, cache_config
+from curl_cffi import requests as curl_requests
+from fastapi import HTTPException, Response
+from core_services import logger, cache_config, yahoo_config, to_json
+from cache_backends import MemoryBackend, NullBackend, RedisBackend, TieredBackend
+import asyncio
 import math
+import orjson
+import time
+from collections import Counter, defaultdict
+from functools import partial, wraps
 from datetime import datetime, timezone
 
+try:
+    from prometheus_client import REGISTRY
+    from prometheus_client.core import CounterMetricFamily
+except ImportError:  # optional dependency: pip install "yfinance-api-server[metrics]"
+    REGISTRY = None
+
 # --- Cache Setup ---
-if cache_config.get("enabled", True):
-    ttl = cache_config.get("ttl_seconds", 600)
+# A single cache shared by all the endpoints, keyed by (kind, *args): the hot
+# kinds (quote) can use the room left free by the cold ones (calendar).
+# Each kind expires according to how often Yahoo updates that data.
+# Backends (cache_backends.py): in-process "memory" (default) or "redis", shared
+# by all the workers of a multi-process deployment.
+DAY = 86400
+CACHE_TTLS = {
+    "info": 60,
+    "history_intraday": 60,
+    "history_recent": 300,
+    "history_daily": DAY,
+    "recommendations": 7 * DAY,
+    "calendar": 30 * DAY,
+    "dividends": 90 * DAY,
+    "splits": 90 * DAY,
+}
+
+# Short daily histories, where today's still-open bar is a large part of the answer
+_RECENT_PERIODS = {"1d", "5d", "1mo"}
+
+def _ttl_for(key):
+    """TTL of a cache key (kind, *args). 'quote' and unknown kinds use the global ttl_seconds."""
+    kind = key[0]
+    if kind == "history":
+        period, interval = key[2], key[3]
+        if interval.endswith(("m", "h")):
+            kind = "history_intraday"
+        elif interval in ("1d", "5d") and period in _RECENT_PERIODS:
+            kind = "history_recent"
+        else:
+            kind = "history_daily"
+    return CACHE_TTLS.get(kind, ttl)
+
+ttl = cache_config.get("ttl_seconds", 600)
+# Negative caching: unknown symbols are remembered for a short time, and legitimately
+# empty results (e.g. no dividends) for at most a day, so repeated requests for
+# bogus symbols or dividend-less stocks do not go upstream every time.
+# Transient failures (timeouts, rate limits, ...) are not cached.
+ERROR_TTL = cache_config.get("error_ttl_seconds", 300)
+EMPTY_TTL = cache_config.get("empty_ttl_seconds", DAY)
+_EMPTY_PAYLOADS = (b"[]", b"{}")
+_ERROR_MARK = b"\x00error:"  # prefix of a cached failure (JSON payloads never start with it)
+
+class SymbolNotFound(ValueError):
+    """Yahoo has no data for the symbol: the one failure that is cached."""
+
+class UpstreamError(Exception):
+    """A recent SymbolNotFound, replayed from the cache."""
+
+# Stale-while-revalidate: entries of these kinds are kept their grace seconds past
+# their TTL. In that window they are still served immediately while a background
+# task refreshes them, so TTL expiry does not put a Yahoo round trip in front of users.
+# Quotes get a short grace: a stale response does not say it is stale, and a
+# quote is read as a live price.
+STALE_GRACES = {"info": 300, "history": 300, "quote": 30}
+STALE_GRACES.update(cache_config.get("stale_grace_seconds", {}))
+
+def _grace_for(key):
+    return STALE_GRACES.get(key[0], 0)
+
+# After a failed background refresh, the stale value is served without new
+# refresh attempts for REFRESH_BACKOFF seconds, so a Yahoo outage or rate
+# limiting does not turn every hit of a hot key into an upstream call.
+REFRESH_BACKOFF = cache_config.get("refresh_backoff_seconds", 30)
+_refresh_retry_at = {}  # key -> time.monotonic() before which no refresh is tried
+
+def _refresh_due(key):
+    retry_at = _refresh_retry_at.get(key)
+    if retry_at is None:
+        return True
+    if time.monotonic() < retry_at:
+        return False
+    del _refresh_retry_at[key]
+    return True
+
+CACHE_ENABLED = cache_config.get("enabled", True)
+if CACHE_ENABLED:
     max_size = cache_config.get("max_size", 128)
+    backend_name = cache_config.get("backend", "memory")
+    CACHE_TTLS.update(cache_config.get("ttls", {}))
     
-    logger.info(f"Caching enabled: TTL={ttl}s, MaxSize={max_size}")
-    
-    # Single item caches
-    info_cache = TTLCache(maxsize=max_size, ttl=ttl)
-    history_cache = TTLCache(maxsize=max_size, ttl=ttl)
-    quote_cache = TTLCache(maxsize=max_size, ttl=ttl)
-    dividends_cache = TTLCache(maxsize=max_size, ttl=ttl)
-    splits_cache = TTLCache(maxsize=max_size, ttl=ttl)
-    recommendations_cache = TTLCache(maxsize=max_size, ttl=ttl)
-    calendar_cache = TTLCache(maxsize=max_size, ttl=ttl)
-    
-    # Batch result caches
-    multi_info_cache = TTLCache(maxsize=64, ttl=ttl)
-    multi_quote_cache = TTLCache(maxsize=64, ttl=ttl)
+    logger.info(f"Caching enabled ({backend_name}): TTL={ttl}s, TTLs by kind={CACHE_TTLS}, MaxSize={max_size * 4}")
+    if backend_name == "redis":
+        _backend = RedisBackend(cache_config.get("redis_url", "redis://localhost:6379/0"))
+        l1_ttl = cache_config.get("l1_ttl_seconds", 10)
+        if l1_ttl > 0:
+            _backend = TieredBackend(_backend, cache_config.get("l1_max_size", 256), l1_ttl)
+    else:
+        _backend = MemoryBackend(maxsize=max_size * 4)
 else:
     logger.info("Caching is disabled via config.")
-    # Dummy caches
-    info_cache = TTLCache(maxsize=1, ttl=1)
-    history_cache = TTLCache(maxsize=1, ttl=1)
-    quote_cache = TTLCache(maxsize=1, ttl=1)
-    dividends_cache = TTLCache(maxsize=1, ttl=1)
-    splits_cache = TTLCache(maxsize=1, ttl=1)
-    recommendations_cache = TTLCache(maxsize=1, ttl=1)
-    calendar_cache = TTLCache(maxsize=1, ttl=1)
-    multi_info_cache = TTLCache(maxsize=1, ttl=1)
-    multi_quote_cache = TTLCache(maxsize=1, ttl=1)
+    _backend = NullBackend()
+
+async def close_cache():
+    """Releases the cache backend (e.g. the Redis connections). Called on server shutdown."""
+    await _backend.close()
+
+# --- Cache Metrics ---
+# Event counters by kind: hits (stale_hits among them), error_hits (replayed
+# unknown symbols, left out of the hit ratio), misses, upstream fetches and
+# their errors. Only touched from the event loop, so plain Counters do.
+# fetches < misses means concurrent misses were coalesced by the single-flight.
+CACHE_STATS = defaultdict(Counter)
+_STAT_EVENTS = ("hits", "stale_hits", "error_hits", "misses", "fetches", "errors")
+
+def cache_stats():
+    """Snapshot of the cache counters, by kind and in total, plus the backend's own figures."""
+    total = Counter()
+    kinds = {}
+    for kind, counts in CACHE_STATS.items():
+        total.update(counts)
+        kinds[kind] = _with_hit_ratio(counts)
+    return {"enabled": CACHE_ENABLED, "backend": _backend.stats(), "total": _with_hit_ratio(total), "kinds": kinds}
+
+def _with_hit_ratio(counts):
+    lookups = counts["hits"] + counts["misses"]
+    return {**{e: counts[e] for e in _STAT_EVENTS}, "hit_ratio": round(counts["hits"] / lookups, 4) if lookups else None}
+
+class _CacheStatsCollector:
+    """Exposes CACHE_STATS to Prometheus at scrape time: nothing added to the request path."""
+    def collect(self):
+        for event in _STAT_EVENTS:
+            metric = CounterMetricFamily(f"yf_cache_{event}", f"yfinance cache {event.replace('_', ' ')}", labels=["resource"])
+            for kind, counts in CACHE_STATS.items():
+                metric.add_metric([kind], counts[event])
+            yield metric
+
+if REGISTRY is not None:
+    REGISTRY.register(_CacheStatsCollector())
+
+# Fetches in progress, by cache key. Concurrent calls for the same cold key await
+# the first one's task (single-flight) instead of all hitting Yahoo.
+# Only touched from the event loop: no lock needed.
+_in_flight = {}
+
+async def _fetch_and_store(key, fetch_json, args, refresh):
+    """
+    Runs the blocking fetcher in a worker thread and caches its result, or a
+    SymbolNotFound for at most the key's own TTL. Other failures are not cached.
+    A failed background refresh keeps the stale value instead.
+    """
+    stats = CACHE_STATS[key[0]]
+    stats["fetches"] += 1
+    try:
+        value = await asyncio.to_thread(fetch_json, *args)
+    except Exception as e:
+        stats["errors"] += 1
+        if refresh:
+            _refresh_retry_at[key] = time.monotonic() + REFRESH_BACKOFF
+            logger.warning(f"Background refresh of {key} failed: {e}")
+        elif isinstance(e, SymbolNotFound):
+            await _backend.setex(key, min(ERROR_TTL, _ttl_for(key)), _ERROR_MARK + str(e).encode())
+        raise
+    key_ttl = _ttl_for(key)
+    if value in _EMPTY_PAYLOADS:
+        key_ttl = min(key_ttl, EMPTY_TTL)
+    await _backend.setex(key, key_ttl + _grace_for(key), value)
+    return value
+
+def _start_fetch(key, fetch_json, args, refresh=False):
+    task = asyncio.ensure_future(_fetch_and_store(key, fetch_json, args, refresh))
+    _in_flight[key] = task
+
+    def done(task):
+        del _in_flight[key]
+        if not task.cancelled():
+            task.exception()  # retrieved: a refresh nobody awaits must not warn
+    task.add_done_callback(done)
+    return task
+
+def _cached(kind):
+    """
+    Turns the decorated blocking fetcher into a coroutine memoized in the shared
+    cache under the key (kind, *args).
+    A hit is a backend lookup on the event loop; a miss runs the fetcher in a
+    worker thread, once per key however many callers are waiting for it.
+    Results are stored already encoded as JSON bytes, so a hit does no
+    serialization work at all.
+    With caching disabled the coroutine just runs the fetcher, without backend calls.
+    """
+    def decorator(fetch):
+        stats = CACHE_STATS[kind]
+
+        def fetch_json(*args):
+            return to_json(fetch(*args))
+
+        if not CACHE_ENABLED:
+            @wraps(fetch)
+            async def uncached(*args):
+                stats["fetches"] += 1
+                try:
+                    return await asyncio.to_thread(fetch_json, *args)
+                except Exception:
+                    stats["errors"] += 1
+                    raise
+            return uncached
+
+        @wraps(fetch)
+        async def wrapper(*args):
+            key = (kind, *args)
+            entry = await _backend.get(key)
+            if entry is not None:
+                value, remaining = entry
+                if value.startswith(_ERROR_MARK):
+                    stats["error_hits"] += 1
+                    raise UpstreamError(value[len(_ERROR_MARK):].decode())
+                stats["hits"] += 1
+                if remaining <= _grace_for(key):
+                    stats["stale_hits"] += 1
+                    if key not in _in_flight and _refresh_due(key):
+                        _start_fetch(key, fetch_json, args, refresh=True)  # serve it, refresh in background
+                return value
+            stats["misses"] += 1
+            task = _in_flight.get(key) or _start_fetch(key, fetch_json, args)
+            # shield: a client going away must not cancel the fetch the others are awaiting
+            return await asyncio.shield(task)
+        return wrapper
+    return decorator
+
+# --- Shared HTTP Session ---
+# A single keep-alive session for all the yfinance calls, so the connections
+# (and TLS handshakes) to Yahoo are reused instead of being redone per ticker.
+# curl_cffi with browser impersonation is the session type yfinance recommends.
+# It keeps one curl handle (and connection pool) per worker thread: requests from
+# different threads use different connections, HTTP/2 or not. HTTP/2 is what the
+# impersonated Chrome negotiates, and it saves on headers (HPACK) per request.
+YAHOO_TIMEOUT = yahoo_config.get("timeout_seconds", 10)
+
+class _YahooSession(curl_requests.Session):
+    """
+    Session capping every request at YAHOO_TIMEOUT seconds. yfinance passes its
+    own timeout= on each call (up to 30 s), which overrides a session default.
+    """
+    def request(self, method, url, *args, timeout=None, **kwargs):
+        if isinstance(timeout, tuple):  # (connect, read)
+            timeout = tuple(min(t, YAHOO_TIMEOUT) for t in timeout)
+        elif isinstance(timeout, (int, float)):
+            timeout = min(timeout, YAHOO_TIMEOUT)
+        else:  # not given, or None (no limit)
+            timeout = YAHOO_TIMEOUT
+        return super().request(method, url, *args, timeout=timeout, **kwargs)
+
+_session = _YahooSession(impersonate="chrome", http_version=yahoo_config.get("http_version", "v2"))
+
+def _get_ticker(symbol):
+    """
+    Builds a yf.Ticker bound to the shared session.
+    Ticker objects are deliberately not pooled: they keep their .info/fast_info
+    forever once fetched, which would defeat the cache TTLs. The cookie/crumb is
+    already shared by all of them (yfinance keeps it in a process-wide singleton).
+    """
+    return yf.Ticker(symbol, session=_session)
+
+def close_session():
+    """Closes the shared HTTP session. Called on server shutdown."""
+    _session.close()
+
+def warm_up(symbol):
+    """
+    Primes DNS, the pooled connections, the Yahoo cookie/crumb and yfinance's lazy
+    imports with a cheap fast_info call, so the first real request does not pay for them.
+    """
+    try:
+        _get_ticker(symbol).fast_info.last_price
+        logger.info(f"yfinance warm-up done with {symbol}")
+    except Exception as e:
+        logger.warning(f"yfinance warm-up with {symbol} failed: {e}")
+
+# --- Fan-out ---
+# The per-symbol fetches of a multi-symbol request run concurrently, so the wall
+# time is the one of the slowest symbol instead of the sum of all of them.
+
+async def _fan_out(symbols_list, fetch_one, limit=None):
+    """
+    Awaits the coroutine fetch_one for every symbol concurrently, at most 'limit'
+    at a time if given. fetch_one must not raise.
+    """
+    if limit:
+        semaphore = asyncio.Semaphore(limit)
+        unbounded = fetch_one
+
+        async def fetch_one(sym):
+            async with semaphore:
+                return await unbounded(sym)
+    return dict(zip(symbols_list, await asyncio.gather(*(fetch_one(sym) for sym in symbols_list))))
+
+# --- Helper: JSON Encoding ---
+
+def _json_object(parts):
+    """Assembles a JSON object from {key: already encoded JSON bytes}, without re-encoding the values."""
+    return b"{" + b",".join(orjson.dumps(k) + b":" + v for k, v in parts.items()) + b"}"
+
+def _json_response(payload):
+    return Response(content=payload, media_type="application/json")
 
 # --- Helper: Data Mapping ---
 
-def _map_fast_info_to_dict(ticker_symbol, fi, info=None):
+def _df_to_records(df):
+    """
+    Converts a DataFrame/Series (index included) into a list of row dicts.
+    Works column-wise: every column becomes a Python list in a single pass and
+    rows are zipped together, avoiding the per-row boxing of to_dict("records").
+    """
+    df = df.reset_index()
+    keys = list(df.columns)
+    columns = [df[k].tolist() for k in keys]
+    return [dict(zip(keys, row)) for row in zip(*columns)]
+
+def _format_index(index):
+    """Index values as a list; datetimes are ISO formatted vectorially, like Timestamp.isoformat()."""
+    if not isinstance(index, pd.DatetimeIndex):
+        return index.tolist()
+    if index.tz is None:
+        return index.strftime("%Y-%m-%dT%H:%M:%S").tolist()
+    # %z gives '-0500': insert the colon of the ISO offset ('-05:00')
+    iso = pd.Series(index.strftime("%Y-%m-%dT%H:%M:%S%z"))
+    return (iso.str[:-2] + ":" + iso.str[-2:]).tolist()
+
+def _df_to_columns(df):
+    """
+    Converts a DataFrame (index included) into a columnar {column: values} dict.
+    Numeric columns stay NumPy arrays, encoded natively by orjson: no Python
+    object is created per cell.
+    """
+    columns = {df.index.name or "index": _format_index(df.index)}
+    for name in df.columns:
+        values = df[name].to_numpy()
+        columns[name] = np.ascontiguousarray(values) if values.dtype.kind in "biuf" else values.tolist()
+    return columns
+
+def _columns_to_records(payload):
+    """Rebuilds the records (list of rows) JSON from a cached columnar JSON payload."""
+    columns = orjson.loads(payload)
+    return orjson.dumps([dict(zip(columns, row)) for row in zip(*columns.values())])
+
+def _map_fast_info_to_dict(ticker_symbol, fi):
     """Helper to extract and clean data from the fast_info object."""
     def clean(val):
         return val if (val is not None and not math.isnan(val)) else None
@@ -60,12 +376,6 @@ def _map_fast_info_to_dict(ticker_symbol, fi, info=None):
 
     exch_timezone = getattr(fi, 'timezone', None)
 
-    # get the official timestamp from 'info' if available
-    market_time = None
-    if info and isinstance(info, dict):
-        market_time = info.get("regularMarketTime")
-    iso_time = datetime.utcfromtimestamp(market_time).isoformat() + "Z" if market_time else None
-
     return {
         "symbol": ticker_symbol,
         "currentPrice": clean(last_price),
@@ -77,132 +387,138 @@ def _map_fast_info_to_dict(ticker_symbol, fi, info=None):
         "percentChange": clean(pct_change),
         "volume": clean(fi.last_volume),
         "exchangeTimezone": exch_timezone,
-        "timestamp": iso_time,
+        # market time (regularMarketTime) needs '.info', which quotes skip: kept null
+        "timestamp": None,
         "fetchTime": datetime.now(timezone.utc).isoformat()
     }
 
 # --- Core Fetching Functions (Single) ---
 
-@cached(info_cache, lock=None)
+@_cached("info")
 def _fetch_info_single(ticker_symbol):
-    logger.info(f"CACHE MISS: Fetching info for {ticker_symbol}")
-    ticker = yf.Ticker(ticker_symbol)
-    # Basic validation
-    if not ticker.info or (len(ticker.info) == 1 and 'regularMarketPrice' not in ticker.info):
-         pass 
-    return ticker.info
-
-@cached(quote_cache, lock=None)
+    logger.debug("CACHE MISS: Fetching info for %s", ticker_symbol)
+    info = _get_ticker(ticker_symbol).info  # property: read it once
+    # Unknown symbols come back empty or as a lone stub field
+    if not info or (len(info) == 1 and 'regularMarketPrice' not in info):
+        raise SymbolNotFound(f"No info found for {ticker_symbol}")
+    return info
+
+@_cached("quote")
 def _fetch_quote_single(ticker_symbol):
-    logger.info(f"CACHE MISS: Fetching quote for {ticker_symbol}")
-    ticker = yf.Ticker(ticker_symbol)
-    info = ticker.info
-    return _map_fast_info_to_dict(ticker_symbol, ticker.fast_info, info)
+    logger.debug("CACHE MISS: Fetching quote for %s", ticker_symbol)
+    ticker = _get_ticker(ticker_symbol)
+    # fast_info only: '.info' is the heaviest Yahoo call and a quote does not need it
+    return _map_fast_info_to_dict(ticker_symbol, ticker.fast_info)
 
-@cached(history_cache, lock=None)
+@_cached("history")
 def _fetch_history_single(ticker_symbol, period, interval):
-    logger.info(f"CACHE MISS: Fetching history for {ticker_symbol}")
-    ticker = yf.Ticker(ticker_symbol)
-    hist = ticker.history(period=period, interval=interval)
-    if hist.empty:
-        return [] 
-    return hist.reset_index().to_dict(orient="records")
-
-# --- Core Fetching Functions (Batch) ---
-
-@cached(multi_info_cache, lock=None)
-def _fetch_info_batch(symbols_str):
-    """Uses yf.Tickers for threaded batch fetching of info."""
-    logger.info(f"CACHE MISS: Fetching batch info for: {symbols_str}")
-    tickers = yf.Tickers(symbols_str)
-    results = {}
-    for symbol, ticker_obj in tickers.tickers.items():
-        try:
-            results[symbol] = ticker_obj.info
-        except Exception as e:
-            logger.warning(f"Batch info error for {symbol}: {e}")
-            results[symbol] = None
-    return results
-
-@cached(multi_quote_cache, lock=None)
-def _fetch_quote_batch(symbols_str):
-    """Uses yf.Tickers for threaded batch fetching of quotes."""
-    logger.info(f"CACHE MISS: Fetching batch quotes for: {symbols_str}")
-    tickers = yf.Tickers(symbols_str)
-    results = {}
-    for symbol, ticker_obj in tickers.tickers.items():
-        try:
-            info = ticker_obj.info
-            results[symbol] = _map_fast_info_to_dict(symbol, ticker_obj.fast_info, info)
-        except Exception as e:
-            logger.warning(f"Batch quote error for {symbol}: {e}")
-            results[symbol] = None
-    return results
+    """Cached in the columnar form only: both orients share one entry and one Yahoo call."""
+    logger.debug("CACHE MISS: Fetching history for %s", ticker_symbol)
+    hist = _get_ticker(ticker_symbol).history(period=period, interval=interval)
+    return {} if hist.empty else _df_to_columns(hist)
 
 # --- Public Accessors (Unified) ---
+# Coroutines returning ready-to-send JSON responses built from the cached bytes.
+
+# Max number of concurrent upstream fetches for one multi-symbol info/quote request
+BATCH_CONCURRENCY = 20
 
-def get_info(symbols_list):
-    # ROUTER INTELLIGENTE: 1 simbolo -> cache singola, N simboli -> cache batch
+async def get_info(symbols_list):
     if len(symbols_list) == 1:
         sym = symbols_list[0]
-        return {sym: _fetch_info_single(sym)}
-    
-    joined = " ".join(sorted(symbols_list))
-    return _fetch_info_batch(joined)
+        return _json_response(_json_object({sym: await _fetch_info_single(sym)}))
+
+    # N symbols: every symbol is cached on its own (AAPL,MSFT and AAPL,TSLA share
+    # AAPL); only the missing ones go upstream, BATCH_CONCURRENCY at a time.
+    async def fetch_one(sym):
+        try:
+            return await _fetch_info_single(sym)
+        except Exception as e:
+            logger.warning(f"Batch info error for {sym}: {e}")
+            return b"null"
+    return _json_response(_json_object(await _fan_out(symbols_list, fetch_one, limit=BATCH_CONCURRENCY)))
 
-def get_quote(symbols_list):
+async def get_quote(symbols_list):
     if len(symbols_list) == 1:
         sym = symbols_list[0]
-        return {sym: _fetch_quote_single(sym)}
-    
-    joined = " ".join(sorted(symbols_list))
-    return _fetch_quote_batch(joined)
+        return _json_response(_json_object({sym: await _fetch_quote_single(sym)}))
 
-def get_history(symbols_list, period, interval):
-    results = {}
-    for sym in symbols_list:
+    # N symbols: per-symbol cache entries, the missing ones fetched concurrently
+    async def fetch_one(sym):
         try:
-            results[sym] = _fetch_history_single(sym, period, interval)
+            return await _fetch_quote_single(sym)
         except Exception as e:
-            results[sym] = {"error": str(e)}
-    return results
+            logger.warning(f"Batch quote error for {sym}: {e}")
+            return b"null"
+    return _json_response(_json_object(await _fan_out(symbols_list, fetch_one, limit=BATCH_CONCURRENCY)))
+
+# Spellings yfinance would treat alike, folded onto one canonical value so they
+# share a cache entry. Inputs are lowercased first; symbols are already uppercased by the API.
+_PERIOD_ALIASES = {
+    "1day": "1d", "5day": "5d", "5days": "5d", "1m": "1mo", "1month": "1mo",
+    "3m": "3mo", "3months": "3mo", "6m": "6mo", "6months": "6mo",
+    "1year": "1y", "1yr": "1y", "2years": "2y", "5years": "5y", "10years": "10y",
+}
+_INTERVAL_ALIASES = {
+    "1min": "1m", "2min": "2m", "5min": "5m", "15min": "15m", "30min": "30m",
+    "60m": "1h", "1hour": "1h", "1day": "1d", "daily": "1d", "1w": "1wk",
+    "1week": "1wk", "weekly": "1wk", "1month": "1mo", "monthly": "1mo", "3month": "3mo",
+}
+
+_VALID_PERIODS = {"1d", "5d", "1mo", "3mo", "6mo", "1y", "2y", "5y", "10y", "ytd", "max"}
+_VALID_INTERVALS = {"1m", "2m", "5m", "15m", "30m", "60m", "90m", "1h", "1d", "5d", "1wk", "1mo", "3mo"}
+
+def _normalize(value, aliases, valid, name):
+    """Canonical form of a period/interval; unknown values are rejected before any upstream call."""
+    value = value.strip().lower()
+    value = aliases.get(value, value)
+    if value not in valid:
+        raise HTTPException(status_code=422, detail=f"Invalid {name} '{value}'. Valid values: {', '.join(sorted(valid))}")
+    return value
+
+async def get_history(symbols_list, period, interval, orient="records"):
+    """orient: 'records' (list of rows) or 'columns' ({column: [values]}, more compact and faster)."""
+    period = _normalize(period, _PERIOD_ALIASES, _VALID_PERIODS, "period")
+    interval = _normalize(interval, _INTERVAL_ALIASES, _VALID_INTERVALS, "interval")
+
+    async def fetch_one(sym):
+        try:
+            columns = await _fetch_history_single(sym, period, interval)
+            return columns if orient == "columns" else _columns_to_records(columns)
+        except Exception as e:
+            return to_json({"error": str(e)})
+    return _json_response(_json_object(await _fan_out(symbols_list, fetch_one)))
 
 # --- Other Single-Only Fetchers (Wrapped in Dict for consistency) ---
 
-def _generic_single_fetch(symbols_list, cache_func):
-    results = {}
-    for sym in symbols_list:
+async def _generic_single_fetch(symbols_list, cache_func):
+    async def fetch_one(sym):
         try:
-            results[sym] = cache_func(sym)
+            return await cache_func(sym)
         except Exception:
-            results[sym] = []
-    return results
-
-@cached(dividends_cache, lock=None)
-def _fetch_dividends_single(sym):
-    t = yf.Ticker(sym)
-    return t.dividends.reset_index().to_dict(orient="records") if not t.dividends.empty else []
+            return b"[]"
+    return _json_response(_json_object(await _fan_out(symbols_list, fetch_one)))
 
-@cached(splits_cache, lock=None)
-def _fetch_splits_single(sym):
-    t = yf.Ticker(sym)
-    return t.splits.reset_index().to_dict(orient="records") if not t.splits.empty else []
+def _fetch_df_attr(sym, attr, post=_df_to_records):
+    """Generic fetcher of a DataFrame/Series attribute of a Ticker (dividends, splits, ...)."""
+    df = getattr(_get_ticker(sym), attr)  # property: read it once
+    return [] if df is None or df.empty else post(df)
 
-@cached(recommendations_cache, lock=None)
-def _fetch_recs_single(sym):
-    t = yf.Ticker(sym)
-    return t.recommendations.reset_index().to_dict(orient="records") if not t.recommendations.empty else []
+_fetch_dividends_single = _cached("dividends")(partial(_fetch_df_attr, attr="dividends"))
+_fetch_splits_single = _cached("splits")(partial(_fetch_df_attr, attr="splits"))
+_fetch_recs_single = _cached("recommendations")(partial(_fetch_df_attr, attr="recommendations"))
 
-@cached(calendar_cache, lock=None)
+@_cached("calendar")
 def _fetch_calendar_single(sym):
-    t = yf.Ticker(sym)
-    if t.calendar.empty: return {}
-    cal = t.calendar.to_dict().get(0, {})
-    return {k: (v.isoformat() if hasattr(v, 'isoformat') else v) for k, v in cal.items()}
+    cal = _get_ticker(sym).calendar
+    if isinstance(cal, pd.DataFrame):  # older yfinance: a one-column DataFrame
+        cal = {} if cal.empty else cal.iloc[:, 0].to_dict()
+    # dates, Timestamps and numpy values are encoded by to_json, no per-key cleanup needed
+    return cal or {}
 
 # --- Public Wrappers ---
 
-def get_dividends(symbols_list): return _generic_single_fetch(symbols_list, _fetch_dividends_single)
-def get_splits(symbols_list): return _generic_single_fetch(symbols_list, _fetch_splits_single)
-def get_recommendations(symbols_list): return _generic_single_fetch(symbols_list, _fetch_recs_single)
-def get_calendar(symbols_list): return _generic_single_fetch(symbols_list, _fetch_calendar_single)
\ No newline at end of file
+async def get_dividends(symbols_list): return await _generic_single_fetch(symbols_list, _fetch_dividends_single)
+async def get_splits(symbols_list): return await _generic_single_fetch(symbols_list, _fetch_splits_single)
+async def get_recommendations(symbols_list): return await _generic_single_fetch(symbols_list, _fetch_recs_single)
+async def get_calendar(symbols_list): return await _generic_single_fetch(symbols_list, _fetch_calendar_single)
@@ -1,8 +1,188 @@
+import asyncio
+import threading
+import time
+
+import orjson
+import pandas as pd
+import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
-from yfinance_api.api_server import app
+from yfinance_api.api_server import app, parse_symbols
+import cache_backends
+import yfinance_service as svc
 
 client = TestClient(app)
 
 def test_health_root_returns_200():
     resp = client.get("/")
     assert resp.status_code == 200
+
+def test_large_responses_are_gzipped():
+    resp = client.get("/openapi.json", headers={"Accept-Encoding": "gzip"})
+    assert resp.status_code == 200
+    assert resp.headers.get("content-encoding") == "gzip"
+
+def test_parse_symbols_dedups_preserving_order():
+    assert parse_symbols("msft", " aapl, MSFT ,,eni.mi,AAPL") == ["AAPL", "MSFT", "ENI.MI"]
+
+def test_missing_symbols_returns_400():
+    resp = client.get("/tickers/quote")
+    assert resp.status_code == 400
+
+def test_parse_symbols_keeps_yahoo_special_chars():
+    assert parse_symbols(None, "^gspc,eurusd=x, brk-b") == ["^GSPC", "EURUSD=X", "BRK-B"]
+
+def test_invalid_history_params_return_422():
+    assert client.get("/tickers/history?symbols=AAPL&period=forever").status_code == 422
+    assert client.get("/tickers/history?symbols=AAPL&interval=7m").status_code == 422
+    assert client.get(f"/tickers/quote?symbols={'A' * 30}").status_code == 422
+
+def test_cache_stats_endpoint():
+    resp = client.get("/cache/stats")
+    assert resp.status_code == 200
+    assert {"hits", "misses", "fetches", "hit_ratio"} <= resp.json()["total"].keys()
+
+def test_junk_symbols_are_rejected_not_split():
+    with pytest.raises(HTTPException) as exc:
+        parse_symbols(None, "BRK/B;rm -rf,$AAPL, A&B")
+    assert exc.value.status_code == 422
+    assert client.get("/tickers/quote?symbols=AAPL,A%26B").status_code == 422
+
+# --- Cache (offline: stub blocking fetchers instead of yfinance) ---
+
+@pytest.fixture
+def cache(monkeypatch):
+    """A fresh, empty memory backend for the _cached fetchers."""
+    backend = cache_backends.MemoryBackend(maxsize=64)
+    monkeypatch.setattr(svc, "_backend", backend)
+    monkeypatch.setattr(svc, "_in_flight", {})
+    monkeypatch.setattr(svc, "_refresh_retry_at", {})
+    return backend
+
+def counting_fetcher(kind, result=lambda n: [n], delay=0.05):
+    """A _cached blocking fetcher that counts its upstream calls (thread-safe)."""
+    calls = []
+    lock = threading.Lock()
+
+    def fetch(sym):
+        with lock:
+            calls.append(sym)
+            n = len(calls)
+        time.sleep(delay)
+        return result(n)
+    return svc._cached(kind)(fetch), calls
+
+def test_concurrent_misses_fetch_once(cache):
+    fetch, calls = counting_fetcher("dividends")
+
+    async def run():
+        return await asyncio.gather(*(fetch("A") for _ in range(10)))
+    assert asyncio.run(run()) == [b"[1]"] * 10
+    assert len(calls) == 1
+
+def test_cancelled_waiter_does_not_cancel_the_fetch(cache):
+    fetch, calls = counting_fetcher("dividends")
+
+    async def run():
+        first = asyncio.create_task(fetch("A"))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await fetch("A")
+    assert asyncio.run(run()) == b"[1]"
+    assert len(calls) == 1
+
+def test_unknown_symbol_is_replayed_transient_error_is_not(cache):
+    def not_found(n):
+        raise svc.SymbolNotFound("No info found for A")
+    fetch, calls = counting_fetcher("info", result=not_found, delay=0)
+    with pytest.raises(svc.SymbolNotFound):
+        asyncio.run(fetch("A"))
+    with pytest.raises(svc.UpstreamError, match="No info found"):
+        asyncio.run(fetch("A"))
+    assert len(calls) == 1
+    assert svc.CACHE_STATS["info"]["error_hits"] >= 1
+
+    def timeout(n):
+        raise TimeoutError("Yahoo timed out")
+    fetch, calls = counting_fetcher("info", result=timeout, delay=0)
+    for _ in range(2):
+        with pytest.raises(TimeoutError):
+            asyncio.run(fetch("B"))
+    assert len(calls) == 2
+
+def test_empty_payload_gets_empty_ttl(cache):
+    fetch, calls = counting_fetcher("dividends", result=lambda n: [], delay=0)
+    assert asyncio.run(fetch("A")) == b"[]"
+    value, remaining = asyncio.run(cache.get(("dividends", "A")))
+    assert value == b"[]"
+    assert svc.EMPTY_TTL - 5 < remaining <= svc.EMPTY_TTL
+
+def test_stale_entry_is_served_while_one_refresh_runs(cache, monkeypatch):
+    monkeypatch.setitem(svc.CACHE_TTLS, "quote", 0)  # stale as soon as stored
+    monkeypatch.setitem(svc.STALE_GRACES, "quote", 60)
+    fetch, calls = counting_fetcher("quote", delay=0.1)
+
+    async def run():
+        assert await fetch("A") == b"[1]"
+        # stale hits: served at once, a single background refresh for all of them
+        assert await asyncio.gather(*(fetch("A") for _ in range(5))) == [b"[1]"] * 5
+        await asyncio.sleep(0.2)
+        return (await cache.get(("quote", "A")))[0]
+    assert asyncio.run(run()) == b"[2]"
+    assert len(calls) == 2
+
+def test_ttl_by_kind_and_history_interval():
+    ttls = svc.CACHE_TTLS
+    assert svc._ttl_for(("history", "A", "5d", "15m")) == ttls["history_intraday"]
+    assert svc._ttl_for(("history", "A", "1mo", "1d")) == ttls["history_recent"]
+    assert svc._ttl_for(("history", "A", "5y", "1d")) == ttls["history_daily"]
+    assert svc._ttl_for(("history", "A", "1mo", "1wk")) == ttls["history_daily"]
+    assert svc._ttl_for(("dividends", "A")) == ttls["dividends"]
+    assert svc._ttl_for(("quote", "A")) == svc.ttl
+
+def test_memory_backend_max_ttl_reports_full_ttl():
+    async def run():
+        l1 = cache_backends.MemoryBackend(maxsize=4, max_ttl=0.05)
+        await l1.setex("k", 100, b"v")
+        value, remaining = await l1.get("k")
+        assert value == b"v" and remaining > 99
+        await asyncio.sleep(0.1)
+        assert await l1.get("k") is None
+    asyncio.run(run())
+
+def test_tiered_backend_keeps_l2_remaining_ttl():
+    async def run():
+        l2 = cache_backends.MemoryBackend(maxsize=4)
+        tiered = cache_backends.TieredBackend(l2, l1_maxsize=4, l1_ttl=10)
+        await l2.setex("k", 100, b"v")
+        assert (await tiered.get("k"))[1] > 99       # from L2, copied into L1
+        await l2.setex("k", 100, b"w")
+        value, remaining = await tiered.get("k")      # from L1
+        assert value == b"v" and remaining > 99
+    asyncio.run(run())
+
+def test_history_orients_share_one_fetch_and_agree(cache, monkeypatch):
+    index = pd.date_range("2024-01-02", periods=3, freq="D", tz="America/New_York", name="Date")
+    df = pd.DataFrame({"Open": [1.5, 2.0, float("nan")], "Volume": [10, 20, 30]}, index=index)
+    calls = []
+
+    class StubTicker:
+        def history(self, period, interval):
+            calls.append((period, interval))
+            return df
+    monkeypatch.setattr(svc, "_get_ticker", lambda sym: StubTicker())
+
+    records = orjson.loads(asyncio.run(svc.get_history(["A"], "1mo", "1d", "records")).body)["A"]
+    columns = orjson.loads(asyncio.run(svc.get_history(["A"], "1mo", "1d", "columns")).body)["A"]
+    assert records == orjson.loads(svc.to_json(svc._df_to_records(df)))
+    assert [dict(zip(columns, row)) for row in zip(*columns.values())] == records
+    assert len(calls) == 1
+
+def test_unknown_single_info_symbol_returns_404(cache, monkeypatch):
+    def not_found(sym):
+        raise svc.SymbolNotFound(f"No info found for {sym}")
+    monkeypatch.setattr(svc, "_fetch_info_single", svc._cached("info")(not_found))
+    for _ in range(2):  # fetched, then replayed from the cache as UpstreamError
+        resp = client.get("/tickers/info?symbol=XYZ")
+        assert resp.status_code == 404
+    assert client.get("/tickers/info?symbols=XYZ,ABC").json() == {"XYZ": None, "ABC": None}